@@ -1,10 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, is_dataclass
 from pathlib import Path
 import json
 from typing import Optional, Union, Dict, Any, List
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+
+@dataclass(slots=True)
 class EmbedConfig:
     data_path: str
     save_path: str
@@ -18,7 +23,7 @@ class EmbedConfig:
     operation_type: str = "embedding"
 
 
-@dataclass
+@dataclass(slots=True)
 class ExtractConfig:
     data_path: str
     blockchain_path: str
@@ -26,7 +31,7 @@ class ExtractConfig:
     operation_type: str = "extraction"
 
 
-@dataclass
+@dataclass(slots=True)
 class RemoveConfig:
     data_path: str
     save_path: str
@@ -34,25 +39,38 @@ class RemoveConfig:
     blockchain_path: str
     data_type: str
     operation_type: str = "removal"
+    # batch-processing knobs: worker count and "process"/"thread" pool
+    max_concurrency: Optional[int] = None
+    executor_kind: str = "process"
 
 
 class ConfigGenerator:
     DEFAULT_KERNEL = [[0, 1 / 4, 0], [1 / 4, 0, 1 / 4], [0, 1 / 4, 0]]
 
+    # parents already created by _validate_paths; shared across instances
+    # so a busy API stops issuing mkdir syscalls for directories it has
+    # already ensured
+    _mkdir_cache: set = set()
+
     def __init__(self, config_dir: str = "configs/database"):
         self.config_dir = Path(config_dir)
         self.config_dir.mkdir(parents=True, exist_ok=True)
 
     def _save_config(self, config: Union[Dict, Any], filename: str) -> None:
         """Save configuration to JSON file."""
-        if hasattr(config, '__dict__'):
-            config_dict = config.__dict__
+        if is_dataclass(config):
+            config_dict = asdict(config)
         else:
             config_dict = config
 
         config_path = self.config_dir / f"{filename}.json"
-        with open(config_path, 'w') as f:
-            json.dump(config_dict, f, indent=4)
+        if orjson is not None:
+            config_path.write_bytes(
+                orjson.dumps(config_dict, option=orjson.OPT_INDENT_2)
+            )
+        else:
+            with open(config_path, 'w') as f:
+                json.dump(config_dict, f, indent=4)
 
     def _load_config(self, filename: str) -> Dict:
         """Load configuration from JSON file."""
@@ -60,6 +78,8 @@ class ConfigGenerator:
         if not config_path.exists():
             raise FileNotFoundError(f"Configuration file not found: {config_path}")
 
+        if orjson is not None:
+            return orjson.loads(config_path.read_bytes())
         with open(config_path, 'r') as f:
             return json.load(f)
 
@@ -67,8 +87,10 @@ class ConfigGenerator:
         """Validate and create paths if they don't exist."""
         for path_name, path_value in paths.items():
             if path_value:
-                path_obj = Path(path_value)
-                path_obj.parent.mkdir(parents=True, exist_ok=True)
+                parent = Path(path_value).parent
+                if parent not in self._mkdir_cache:
+                    parent.mkdir(parents=True, exist_ok=True)
+                    self._mkdir_cache.add(parent)
 
     def generate_embed_config(
             self,
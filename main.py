@@ -1,8 +1,13 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
 from fastapi import FastAPI, HTTPException, File, UploadFile
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
 
+from blockchain.blockchain import Blockchain
 from configs.gen_wat_cfs import ConfigGenerator
 from watermarking.watermark_embedder_batch import BatchEmbedderProcessor
 from watermarking.watermark_extractor import WatermarkExtractor
@@ -42,6 +47,15 @@ class RemoveRequest(BaseModel):
 # Initialize ConfigGenerator
 config_generator = ConfigGenerator()
 
+# Load the blockchain once per process instead of re-parsing the file on
+# every request; Blockchain serializes appends internally.
+blockchain = Blockchain("blockchain/database/blockchainDB.json")
+
+# Executor for blocking batch work, so endpoints don't stall the event
+# loop; the batch processors fan out their own worker processes for the
+# CPU-bound parts. Config generation stays inline (cheap).
+executor = ThreadPoolExecutor()
+
 
 @app.post("/api/generate-config/embed")
 async def generate_embed_config(request: EmbedRequest):
@@ -57,7 +71,7 @@ async def generate_embed_config(request: EmbedRequest):
             t_hi=request.t_hi,
             bit_depth=request.bit_depth
         )
-        return {"status": "success", "config": config.__dict__}
+        return {"status": "success", "config": asdict(config)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -70,7 +84,7 @@ async def generate_extract_config(request: ExtractRequest):
             blockchain_path="blockchain/database/blockchainDB.json",
             data_type=request.data_type
         )
-        return {"status": "success", "config": config.__dict__}
+        return {"status": "success", "config": asdict(config)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -85,7 +99,7 @@ async def generate_remove_config(request: RemoveRequest):
             blockchain_path="blockchain/database/blockchainDB.json",
             data_type=request.data_type
         )
-        return {"status": "success", "config": config.__dict__}
+        return {"status": "success", "config": asdict(config)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -107,8 +121,10 @@ async def embed_watermark(request: EmbedRequest):
         )
 
         # Process embedding
-        processor = BatchEmbedderProcessor(config)
-        result = processor.process_images()
+        processor = BatchEmbedderProcessor(config, blockchain=blockchain)
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, processor.process_images
+        )
 
         return {
             "status": "success",
@@ -132,8 +148,10 @@ async def extract_watermark(request: ExtractRequest):
         )
 
         # Process extraction
-        extractor = WatermarkExtractor(config)
-        result = extractor.extract()
+        extractor = WatermarkExtractor(config, blockchain=blockchain)
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, extractor.extract
+        )
 
         return {
             "status": "success",
@@ -156,8 +174,10 @@ async def remove_watermark(request: RemoveRequest):
         )
 
         # Process removal
-        processor = BatchRemoveProcessor(config)
-        result = processor.process_images()
+        processor = BatchRemoveProcessor(config, blockchain=blockchain)
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, processor.process_images
+        )
 
         return {
             "status": "success",
@@ -0,0 +1,36 @@
+"""Regression tests for blockchain hash stability across reloads."""
+import numpy as np
+
+from blockchain.blockchain import Blockchain
+
+
+def test_verify_chain_after_reload_with_int_keys(tmp_path):
+    """Int dict keys round-trip through JSON as strings; the hash must
+    order them the same way before and after the reload."""
+    chain_path = str(tmp_path / "chain.jsonl")
+    chain = Blockchain(chain_path)
+    # enough keys that numeric and lexicographic order disagree (2 > 10
+    # as ints, "10" < "2" as strings), plus a mixed str/int dict that
+    # would raise TypeError under a raw sort
+    chain.add_transaction(
+        {i: f"value_{i}" for i in range(12)} | {"mixed": {1: "a", "b": 2}},
+        info="embedder")
+    assert chain.verify_chain()
+
+    reloaded = Blockchain(chain_path)
+    assert reloaded.verify_chain()
+
+
+def test_verify_chain_after_reload_with_numpy_scalars(tmp_path):
+    """Numpy scalars reload as plain Python values; the hash must not
+    depend on which of the two forms it sees."""
+    chain_path = str(tmp_path / "chain.jsonl")
+    chain = Blockchain(chain_path)
+    chain.add_transaction(
+        {"count": np.int64(5), "ber": np.float32(0.1),
+         "valid": np.bool_(True), "nan": np.float64("nan")},
+        info="embedder")
+    assert chain.verify_chain()
+
+    reloaded = Blockchain(chain_path)
+    assert reloaded.verify_chain()
@@ -1,7 +1,13 @@
 # utils.py
 import hashlib
+from functools import lru_cache
 import numpy as np
 
+try:
+    from _hashlib import openssl_sha256 as _sha256_backend
+except ImportError:
+    _sha256_backend = hashlib.sha256
+
 
 
 
@@ -26,17 +32,20 @@ def sha256_to_binary_np_array(input_string):
     return binary_np_array
 
 
+@lru_cache(maxsize=8)
 def generate_random_binary_array_from_string(seed_string, array_size):
     # Compute the SHA-256 hash of the seed string
-    sha256_hash = hashlib.sha256(seed_string.encode()).digest()
+    sha256_hash = _sha256_backend(seed_string.encode()).digest()
 
-    # Convert the hash to an integer seed
+    # Convert the hash to an integer seed; kept as an int so keys already
+    # recorded on the blockchain reproduce the identical position stream
     seed = int.from_bytes(sha256_hash, 'big')
 
     # Initialize the NumPy random generator with the derived seed
     rng = np.random.default_rng(seed)
 
-    # Generate a random binary array
+    # Generate a random binary array; cached per (key, size) and treated
+    # as read-only by all callers
     random_binary_array = rng.integers(0, 2, size=array_size, dtype=np.uint8)
 
     return random_binary_array
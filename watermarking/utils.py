@@ -1,41 +1,89 @@
+import os
 import secrets
 import hashlib
-from datetime import datetime
+import threading
+from time import time_ns
 from pathlib import Path
 from typing import Tuple, Union, List
 from PIL import Image
 import numpy as np
 
-
-def generate_secret_key(add_timestamp: bool = True) -> Tuple[str, int]:
+from watermarking import kernels
+
+# Resolve the fastest SHA-256 constructor once at import time. When Python is
+# linked against OpenSSL, its sha256 dispatches to hardware SHA extensions
+# (SHA-NI on x86, ARMv8 crypto) automatically; the plain hashlib constructor
+# is only a fallback for builds without OpenSSL.
+try:
+    from _hashlib import openssl_sha256 as _sha256_backend
+except ImportError:
+    _sha256_backend = hashlib.sha256
+
+# Content-addressed pixel hashes use BLAKE3 when available: its tree mode
+# hashes large buffers with SIMD and multiple threads at close to memory
+# bandwidth, while still yielding a 256-bit cryptographic digest. SHA-256
+# stays in place for key/watermark derivation and chain integrity, where
+# the digest algorithm is part of the recorded semantics.
+try:
+    import blake3 as _blake3
+    CONTENT_HASH_ALGO = "blake3"
+except ImportError:
+    _blake3 = None
+    CONTENT_HASH_ALGO = "sha256"
+
+
+def _sha256(data: bytes) -> str:
+    """Hash bytes with the fastest available SHA-256 backend."""
+    return _sha256_backend(data).hexdigest()
+
+
+try:
+    from numba import njit as _njit
+except ImportError:
+    _njit = None
+
+if _njit is not None:
+    @_njit(cache=True)
+    def _unpack_bits_jit(data: np.ndarray) -> np.ndarray:
+        bits = np.empty(data.size * 8, dtype=np.uint8)
+        for i in range(data.size):
+            byte = data[i]
+            for j in range(8):
+                bits[i * 8 + j] = (byte >> (7 - j)) & 1
+        return bits
+
+    def _bytes_to_bits(data: bytes) -> np.ndarray:
+        """Unpack bytes to a uint8 bit array (compiled path)."""
+        return _unpack_bits_jit(np.frombuffer(data, dtype=np.uint8))
+else:
+    def _bytes_to_bits(data: bytes) -> np.ndarray:
+        """Unpack bytes to a uint8 bit array."""
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def generate_secret_key(add_timestamp: bool = False) -> Tuple[str, int]:
     """
     Generate a secure 256-bit secret key and return it as a hexadecimal string.
 
     Args:
-        add_timestamp: bool, whether to include timestamp in key generation
+        add_timestamp: bool, whether to mix the clock into key generation
 
     Returns:
         Tuple containing:
             - str: The 256-bit secret key as a 64-character hexadecimal string
             - int: The length of the key in bits (always 256)
     """
-    # Generate 32 bytes (256 bits) of random data
+    # Generate 32 bytes (256 bits) of random data; already cryptographically
+    # unique, so no hashing round-trip is needed
     random_bytes = secrets.token_bytes(32)
 
     if add_timestamp:
-        # Add timestamp for additional uniqueness
-        from datetime import datetime
-        timestamp = datetime.now().timestamp()
-        timestamp_bytes = str(timestamp).encode()
-
-        # Combine random bytes with timestamp
-        combined = random_bytes + timestamp_bytes
+        # Mix the clock in for extra domain separation; XOR preserves the
+        # full 256 bits of entropy and skips the SHA-256 round-trip
+        stamp = time_ns().to_bytes(32, 'little')
+        random_bytes = bytes(a ^ b for a, b in zip(random_bytes, stamp))
 
-        # Hash the combined value to get final 256-bit key
-        key = hashlib.sha256(combined).hexdigest()
-    else:
-        # Convert random bytes directly to hexadecimal
-        key = random_bytes.hex()
+    key = random_bytes.hex()
 
     # Verify key length
     assert len(key) == 64, "Key length must be 64 hexadecimal characters (256 bits)"
@@ -76,14 +124,9 @@ def string_to_sha256_bits(input_string):
     Returns:
         A NumPy array representing the SHA256 hash as bits.
     """
-    sha256_hash = hashlib.sha256(input_string.encode('utf-8')).hexdigest()
-    # bits = hex_to_binary_array(sha256_hash)
-    #
-    # # for char in sha256_hash:
-    # #     hex_value = int(char, 16)
-    # #     bits.extend([int(bit) for bit in bin(hex_value)[2:].zfill(4)])  # Convert hex to 4-bit binary
-
-    return hex_to_binary_array(sha256_hash)
+    # hash straight to raw digest bytes and unpack; no hex round-trip
+    digest = _sha256_backend(input_string.encode('utf-8')).digest()
+    return _bytes_to_bits(digest)
 
 
 def bits_to_hexdigest(bits):
@@ -96,13 +139,10 @@ def bits_to_hexdigest(bits):
     Returns:
         The hexdigest string.
     """
-    hex_digits = []
-    for i in range(0, len(bits), 4):
-        four_bits = bits[i:i+4]
-        four_bits = map(int, four_bits)
-        hex_value = int("".join(map(str, four_bits)), 2)
-        hex_digits.append(hex(hex_value)[2:].zfill(1))  # Convert 4 bits to hex digit
-    return "".join(hex_digits)
+    bits = np.asarray(bits, dtype=np.uint8)
+    # pack bits to bytes in one C-level pass; trim to one hex digit per
+    # 4 bits so packbits' zero-padding does not add trailing digits
+    return np.packbits(bits).tobytes().hex()[:len(bits) // 4]
 
 
 def hex_to_binary_array(hex_string):
@@ -115,22 +155,63 @@ def hex_to_binary_array(hex_string):
     Returns:
         A NumPy array representing the binary bits.
     """
-    scale = 16 ## equals to hexadecimal
-    num_of_bits = 4
-    bits = []
-    for char in hex_string:
-        hex_value = int(char, scale)
-        bits.extend([int(bit) for bit in bin(hex_value)[2:].zfill(num_of_bits)])
-    return np.array(bits)
+    # decode hex to raw bytes, then unpack to bits in one C-level pass
+    return np.unpackbits(np.frombuffer(bytes.fromhex(hex_string), dtype=np.uint8))
 
 
 def compute_hash(data: Union[np.ndarray, Image.Image]) -> str:
-    """Compute SHA-256 hash of image data."""
+    """Compute the content hash of image data (see CONTENT_HASH_ALGO)."""
     if isinstance(data, np.ndarray):
-        data_bytes = data.tobytes()
-    else:
-        data_bytes = data.tobytes()
-    return hashlib.sha256(data_bytes).hexdigest()
+        # hash the array buffer in place; tobytes() would first copy the
+        # whole image into a temporary bytes object
+        buffer = np.ascontiguousarray(data)
+        if _blake3 is not None:
+            # blake3 only accepts u8 buffers, so hand it a flat byte view
+            # of the same memory (16-bit DICOM arrays raise BufferError
+            # otherwise)
+            return _blake3.blake3(memoryview(buffer).cast('B'),
+                                  max_threads=_blake3.blake3.AUTO).hexdigest()
+        return _sha256_backend(buffer).hexdigest()
+    if _blake3 is not None:
+        return _blake3.blake3(data.tobytes()).hexdigest()
+    return _sha256(data.tobytes())
+
+
+def compute_neighbourhood_sums(image: np.ndarray, kernel: np.ndarray, stride: int) -> np.ndarray:
+    """
+    Compute the floored kernel-weighted neighbour sum for every output
+    position in one vectorized pass.
+
+    Equivalent to np.sum(region * kernel) // 1 per (y, x) but built from a
+    single strided window view, so no per-pixel slicing or temporaries.
+    Callers that mutate the image while iterating must only use this when
+    regions cannot overlap already-written centers (stride >= kernel size).
+
+    Args:
+        image: 2D image array
+        kernel: 2D kernel array
+        stride: step between consecutive regions
+
+    Returns:
+        (out_h, out_w) int64 array of floored neighbour sums
+    """
+    output_height = (image.shape[0] - kernel.shape[0]) // stride + 1
+    output_width = (image.shape[1] - kernel.shape[1]) // stride + 1
+    if kernels.NUMBA_AVAILABLE:
+        image_c = np.ascontiguousarray(image)
+        kernel_c = np.ascontiguousarray(kernel, dtype=np.float64)
+        # the parallel kernel may only be entered from the main thread:
+        # numba's workqueue layer deadlocks at interpreter shutdown when
+        # its prange is first reached from a worker thread, so thread-
+        # pool callers get the serial variant
+        if threading.current_thread() is threading.main_thread():
+            return kernels.neighbour_sums_loop(
+                image_c, kernel_c, stride, output_height, output_width)
+        return kernels.neighbour_sums_loop_serial(
+            image_c, kernel_c, stride, output_height, output_width)
+    window_view = np.lib.stride_tricks.sliding_window_view(image, kernel.shape)
+    sums = np.einsum('yxhw,hw->yx', window_view[::stride, ::stride], kernel, optimize=True)
+    return np.floor(sums).astype(np.int64)
 
 
 def generate_watermark(message: str, secret_key: str) -> np.ndarray:
@@ -139,15 +220,25 @@ def generate_watermark(message: str, secret_key: str) -> np.ndarray:
     return string_to_sha256_bits(combined_input)
 
 
-def get_image_files(supported_formats, directory: str) -> List[Path]:
+# canonical lowercased suffixes the batch processors accept; shared
+# immutable constant instead of a per-instance mutable set
+SUPPORTED_FORMATS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.dcm'})
+
+
+def iter_image_files(supported_formats, directory: str):
     """
-    Get all supported image files from directory.
+    Yield supported image files from directory as they are enumerated.
+
+    Streaming counterpart of get_image_files: scandir DirEntry objects
+    expose is_file() without an extra stat per entry, so callers can
+    start submitting work before a huge directory finishes enumerating.
+    Yield order is the directory's, not sorted.
 
     Args:
         directory: Directory path to scan for images
 
-    Returns:
-        List of Path objects for valid image files
+    Yields:
+        Path objects for valid image files
         :param directory:
         :param supported_formats:
     """
@@ -155,8 +246,26 @@ def get_image_files(supported_formats, directory: str) -> List[Path]:
     if not directory_path.exists():
         raise FileNotFoundError(f"Directory not found: {directory}")
 
-    image_files = []
-    for ext in supported_formats:
-        image_files.extend(directory_path.glob(f"*{ext}"))
+    # one scandir sweep instead of one glob traversal per extension;
+    # endswith against a tuple checks all suffixes in a single C call
+    suffixes = tuple(ext.lower() for ext in supported_formats)
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if (entry.is_file(follow_symlinks=False)
+                    and entry.name.lower().endswith(suffixes)):
+                yield Path(entry.path)
+
+
+def get_image_files(supported_formats, directory: str) -> List[Path]:
+    """
+    Get all supported image files from directory.
+
+    Args:
+        directory: Directory path to scan for images
 
-    return sorted(set(image_files))
+    Returns:
+        Sorted list of Path objects for valid image files
+        :param directory:
+        :param supported_formats:
+    """
+    return sorted(iter_image_files(supported_formats, directory))
@@ -1,7 +1,5 @@
-import hashlib
 import secrets
-from copy import deepcopy
-from typing import Dict, Tuple, Union
+from typing import Dict
 import numpy as np
 from PIL import Image
 from datetime import datetime
@@ -9,8 +7,9 @@ from dataclasses import dataclass
 
 from pydicom import dcmread
 
+from watermarking.kernels import embed_loop, overflow_loop
 from watermarking.utils import string_to_sha256_bits, generate_secret_key, verify_secret_key, compute_hash, \
-    generate_watermark
+    generate_watermark, compute_neighbourhood_sums, _sha256, CONTENT_HASH_ALGO
 
 
 @dataclass
@@ -28,6 +27,9 @@ class EmbedderTransaction:
     bit_depth: int
     data_type: str
     operation_type: str
+    # algorithm behind hash_image_wat/hash_image_orig; blocks recorded
+    # before this field defaulted to SHA-256
+    hash_algo: str = "sha256"
 
 
 class WatermarkEmbedder:
@@ -36,88 +38,79 @@ class WatermarkEmbedder:
         self.secret_key, self.key_length = generate_secret_key()  # Generate secure key
         self.bit_depth = config.bit_depth  # Default 8-bit image
         self.max_pixel_value = 2 ** self.bit_depth
+        # positions are a pure function of (secret_key, size) and the key
+        # is fixed per embedder, so same-sized images in a batch reuse
+        # one generated sequence
+        self._secret_positions_cache: Dict[int, np.ndarray] = {}
+        # message and key are fixed per embedder, so the transaction
+        # watermark hash is the same for every image in a batch
+        self._final_watermark: str = None
 
     def _generate_secret_positions(self, size: int) -> np.ndarray:
         """Generate secret positions from the secret key."""
         from utils.utils import generate_random_binary_array_from_string
-        # Convert hex key to binary string for position generation
-        return generate_random_binary_array_from_string(self.secret_key, size)
-
-    @staticmethod
-    def _embedding_value(error: int, thresh_hi: int, bit: int) -> Tuple[Union[int, None], Union[int, None]]:
-        """Calculate embedding value based on error and threshold."""
-        if error > thresh_hi:
-            return error + thresh_hi + 1, None
-        elif 0 <= error <= thresh_hi:
-            return 2 * error + bit, bit
-        else:
-            raise ValueError("Invalid error value for embedding")
+        cached = self._secret_positions_cache.get(size)
+        if cached is None:
+            # Convert hex key to binary string for position generation
+            cached = generate_random_binary_array_from_string(self.secret_key, size)
+            self._secret_positions_cache[size] = cached
+        return cached
 
     def _handle_overflow(self, image_np: np.ndarray, original_image: np.ndarray,
-                         overflow_array: list, secret_positions: np.ndarray,
-                         kernel: np.ndarray, stride: int, idx_secret_key: int) -> np.ndarray:
+                         overflow_bits: np.ndarray, overflow_count: int,
+                         secret_positions: np.ndarray,
+                         kernel: np.ndarray, stride: int) -> np.ndarray:
         """Handle overflow cases during watermark embedding."""
-        if not overflow_array:
+        if not overflow_count:
             return image_np
 
-        image_height, image_width = image_np.shape
-        kernel_height, kernel_width = kernel.shape
-        output_height = (image_height - kernel_height) // stride + 1
-        output_width = (image_width - kernel_width) // stride + 1
-
-        # idx_overflow = len(overflow_array) - 1
-        # idx_secret_key = len(secret_positions) - 1
-
-        #  Perform the embedding starting by the last regions
-        if len(overflow_array) != 0:
-            idx_overflow = len(overflow_array)
-            for y in range(output_height - 1, -1, -1):
-                for x in range(output_width - 1, -1, -1):
-                    if idx_overflow == -1:
-                        break
-
-                    if secret_positions[idx_secret_key-1] == 1:
-                        region = original_image[y * stride:y * stride + kernel_height,
-                                 x * stride:x * stride + kernel_width]
-                        neighbours = np.sum(region * kernel) // 1
-                        center = original_image[y * stride + kernel_height // 2,
-                                                x * stride + kernel_width // 2]
-
-                        error = center - neighbours
-                        if error >= 0:
-                            if center in (self.max_pixel_value - 1, self.max_pixel_value - 2):
-                                idx_secret_key -= 1
-                                continue
-
-                            error_w, bit = self._embedding_value(error, self.config.t_hi,
-                                                                 overflow_array[idx_overflow-1])
-                            if error_w is not None:
-                                image_np[y * stride + kernel_height // 2,
-                                         x * stride + kernel_width // 2] = neighbours + error_w
-                            if bit in (0, 1):
-                                idx_overflow -= 1
-
-                    idx_secret_key -= 1
-
-        return image_np
-
-    def embed_watermarks(self) -> EmbedderTransaction:
-        """Main method to embed watermarks in the image."""
+        # reads go to the untouched original image, so the neighbour sums
+        # can be precomputed unconditionally
+        neighbour_sums = compute_neighbourhood_sums(original_image, kernel, stride)
+        # trim to the recorded bits so the wrap-around read at index -1
+        # lands on the last real overflow bit, as in the list-based loop
+        return overflow_loop(image_np, original_image, neighbour_sums,
+                             secret_positions, kernel, stride,
+                             float(self.config.t_hi),
+                             overflow_bits[:overflow_count],
+                             overflow_count, self.max_pixel_value)
+
+    def embed_watermarks(self, data_path: str = None, save_path: str = None) -> EmbedderTransaction:
+        """
+        Main method to embed watermarks in the image.
+
+        Paths default to the config so single-image callers keep working;
+        batch callers pass them per image instead of mutating the shared
+        config, letting one embedder reuse its cached state.
+        """
+        if data_path is None:
+            data_path = self.config.data_path
+        if save_path is None:
+            save_path = self.config.save_path
+
         # Verify secret key
         if not verify_secret_key(self.secret_key):
             raise ValueError("Invalid secret key generated")
 
         if self.config.data_type == "dcm":
-            ds = dcmread(self.config.data_path)
-            image_np = ds.pixel_array
+            ds = dcmread(data_path)
+            # contiguous layout for the window views and buffer hashing,
+            # narrowed to the smallest unsigned dtype the configured bit
+            # depth needs; pixel_array often comes back int16/uint16 and
+            # wider lanes just move more bytes through cache
+            pixel_dtype = np.uint16 if self.bit_depth > 8 else np.uint8
+            image_np = np.ascontiguousarray(ds.pixel_array, dtype=pixel_dtype)
         else:
-            # Load and prepare image
-            image = Image.open(self.config.data_path).convert('L')
-            image_np = np.array(image)
-
-        original_image = deepcopy(image_np)
+            # Load and prepare image; asarray exposes the decoded buffer
+            # without forcing an extra copy, and the writable working
+            # buffer is taken just below
+            image = Image.open(data_path).convert('L')
+            image_np = np.asarray(image)
+
+        original_image = image_np
+        image_np = image_np.copy()
         # Prepare parameters
-        kernel = np.array(self.config.kernel)
+        kernel = np.ascontiguousarray(self.config.kernel, dtype=np.float64)
         watermark = generate_watermark(self.config.message, self.secret_key)
         timestamp = str(datetime.now().timestamp())
 
@@ -126,71 +119,46 @@ class WatermarkEmbedder:
         secret_positions = self._generate_secret_positions(image_size)
 
         # Calculate dimensions
-        image_height, image_width = image_np.shape
         kernel_height, kernel_width = kernel.shape
-        output_height = (image_height - kernel_height) // self.config.stride + 1
-        output_width = (image_width - kernel_width) // self.config.stride + 1
 
-        idx_wat = 0
-        idx_secret_key = 0
-        overflow_array = []
+        # With non-overlapping regions no write can land in a later region,
+        # so all neighbour sums can be computed up front in one pass
+        precompute_safe = self.config.stride >= max(kernel_height, kernel_width)
+        if precompute_safe:
+            neighbour_sums = compute_neighbourhood_sums(image_np, kernel, self.config.stride)
+        else:
+            neighbour_sums = np.zeros((1, 1), dtype=np.int64)
 
         # Main embedding loop
         print("Starting watermark embedding process...")
-        for y in range(output_height):
-            for x in range(output_width):
-                if secret_positions[idx_secret_key] == 1:
-                    region = image_np[y * self.config.stride:y * self.config.stride + kernel_height,
-                             x * self.config.stride:x * self.config.stride + kernel_width]
-                    neighbours = np.sum(region * kernel) // 1
-                    center_y = y * self.config.stride + kernel_height // 2
-                    center_x = x * self.config.stride + kernel_width // 2
-                    center = image_np[center_y, center_x]
-
-                    error = center - neighbours
-                    if error >= 0:
-                        if center == (self.max_pixel_value - 2):
-                            image_np[center_y, center_x] += 1
-                            overflow_array.append(1)
-                            idx_secret_key += 1
-                            idx_wat += 1
-                            continue
-                        elif center == (self.max_pixel_value - 1):
-                            overflow_array.append(0)
-                            idx_secret_key += 1
-                            idx_wat += 1
-                            continue
-
-                        error_w, bit = self._embedding_value(error, self.config.t_hi, watermark[idx_wat % 256])
-
-                        if error_w is not None:
-                            image_np[center_y, center_x] = neighbours + error_w
-
-                            if bit in (0, 1) and y<1:
-                                print("pos embed =", y, x, bit)
-                                # idx_wat += 1
-
-                idx_secret_key += 1
-                idx_wat += 1
-
-        print(f"Initial embedding complete. Handling {len(overflow_array)} overflow cases...")
+        overflow_bits, overflow_count = embed_loop(
+            image_np, neighbour_sums, precompute_safe, kernel,
+            self.config.stride, float(self.config.t_hi), secret_positions,
+            np.ascontiguousarray(watermark, dtype=np.uint8),
+            self.max_pixel_value
+        )
+
+        print(f"Initial embedding complete. Handling {overflow_count} overflow cases...")
         # Handle overflow cases
-        image_np = self._handle_overflow(image_np, original_image, overflow_array,
-                                         secret_positions, kernel, self.config.stride, idx_secret_key)
+        image_np = self._handle_overflow(image_np, original_image, overflow_bits,
+                                         overflow_count, secret_positions, kernel,
+                                         self.config.stride)
 
         # Create and save watermarked image
         if self.config.data_type == "dcm":
             ds.PixelData = image_np.tobytes()
-            ds.save_as(self.config.save_path)
+            ds.save_as(save_path)
         else:
             # Load and prepare image
             watermarked_image = Image.fromarray(np.uint8(image_np))
-            watermarked_image.save(self.config.save_path)
+            watermarked_image.save(save_path)
 
-        # Generate final watermark hash
-        final_watermark = str(hashlib.sha256(
-            (self.config.message + self.secret_key).encode()
-        ).hexdigest())
+        # Generate final watermark hash (computed once, reused per batch)
+        if self._final_watermark is None:
+            self._final_watermark = _sha256(
+                (self.config.message + self.secret_key).encode()
+            )
+        final_watermark = self._final_watermark
 
         # final_watermark = ''.join(format(byte, '08b') for byte in final_watermark)
 
@@ -207,7 +175,8 @@ class WatermarkEmbedder:
             hash_image_orig=compute_hash(original_image),
             bit_depth=self.bit_depth,
             data_type=self.config.data_type,
-            operation_type=self.config.operation_type
+            operation_type=self.config.operation_type,
+            hash_algo=CONTENT_HASH_ALGO
         )
 
         print(f"Watermark embedding completed successfully")
@@ -1,34 +1,41 @@
 import os
+import time
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional
 import json
 from datetime import datetime
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
 from tqdm import tqdm
 
 from blockchain.blockchain import Blockchain
-from watermarking.utils import get_image_files
+from watermarking.utils import SUPPORTED_FORMATS, get_image_files
 from watermarking.watermark_embedder import WatermarkEmbedder
 
 
-@dataclass
+def _embed_single(embedder: WatermarkEmbedder, data_path: str, save_path: str):
+    """Embed one image in a worker process and return its transaction."""
+    return embedder.embed_watermarks(data_path, save_path)
+
+
+@dataclass(slots=True)
 class BatchEmbedTransaction:
     """Data class for batch processing results"""
     processing_time: float
     total_images: int = 0
     processed_images: int = 0
-    failed_images: List[str] = None
-    transaction_dict: Dict[str, dict] = None
+    failed_images: List[str] = field(default_factory=list)
+    transaction_dict: Dict[str, dict] = field(default_factory=dict)
 
 
 class BatchEmbedderProcessor:
-    def __init__(self, config):
+    def __init__(self, config, blockchain: Blockchain = None):
         self.config = config
-        self.supported_formats: Set[str] = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.dcm'}
         self.embedder = WatermarkEmbedder(config)
         self.transaction_dict = {}
-        self.blockchain = Blockchain(config.blockchain_path)
+        self.blockchain = (blockchain if blockchain is not None
+                           else Blockchain(config.blockchain_path))
 
     def process_images(self) -> BatchEmbedTransaction:
         """
@@ -37,11 +44,12 @@ class BatchEmbedderProcessor:
         Returns:
             BatchProcessingResult with processing statistics and transaction dictionary
         """
-        start_time = datetime.now()
+        # monotonic clock: immune to NTP slews and cheaper than datetime
+        start_time = time.perf_counter()
 
         # Get all image files
         try:
-            image_files = get_image_files(self.supported_formats, self.config.data_path)
+            image_files = get_image_files(SUPPORTED_FORMATS, self.config.data_path)
         except FileNotFoundError as e:
             raise FileNotFoundError(f"Error accessing image directory: {str(e)}")
 
@@ -58,29 +66,40 @@ class BatchEmbedderProcessor:
 
         print(f"Starting batch processing of {total_images} images...")
 
-        # Process each image
-        for img_path in tqdm(image_files, total=len(image_files), desc="Processing images"):
-            try:
-                print(f"\nProcessing image: {img_path.name}")
-
-                # Update config with current image paths
-                self.config.data_path = str(img_path)
-                self.config.save_path = str(save_path / f"watermarked_{img_path.name}")
-
-                # Embed watermark
-                transaction = self.embedder.embed_watermarks()
-
-                # Store transaction in dictionary using watermarked image hash as key
-                self.transaction_dict[transaction.hash_image_wat] = asdict(transaction)
-
-                processed_images += 1
-                print(f"Successfully processed: {img_path.name}")
-
-            except Exception as e:
-                print(f"Error processing {img_path.name}: {str(e)}")
-                failed_images.append(str(img_path))
-
-        processing_time = (datetime.now() - start_time).total_seconds()
+        # Embed images in parallel worker processes; each worker gets its
+        # own copy of the embedder, so the shared config is never raced.
+        # Blockchain writes stay in this process after collection.
+        max_workers = min(os.cpu_count() or 1, total_images)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    _embed_single,
+                    self.embedder,
+                    str(img_path),
+                    str(save_path / f"watermarked_{img_path.name}")
+                ): img_path
+                for img_path in image_files
+            }
+
+            # consume results as workers finish rather than in submission
+            # order, so one slow image never stalls collection
+            for future in tqdm(as_completed(futures), total=len(futures),
+                               desc="Processing images"):
+                img_path = futures[future]
+                try:
+                    transaction = future.result()
+
+                    # Store transaction in dictionary using watermarked image hash as key
+                    self.transaction_dict[transaction.hash_image_wat] = asdict(transaction)
+
+                    processed_images += 1
+                    print(f"Successfully processed: {img_path.name}")
+
+                except Exception as e:
+                    print(f"Error processing {img_path.name}: {str(e)}")
+                    failed_images.append(str(img_path))
+
+        processing_time = time.perf_counter() - start_time
 
         # Create result object
         batch_transaction = BatchEmbedTransaction(
@@ -93,7 +112,16 @@ class BatchEmbedderProcessor:
 
         # # Save transaction dictionary in the blockchain
         # Add transaction
-        new_block = self.blockchain.add_transaction(asdict(batch_transaction), info="embedder")
+        # shallow dict reusing the per-image transaction references;
+        # asdict would deep-copy the whole nested structure a second time
+        batch_payload = {
+            "processing_time": processing_time,
+            "total_images": total_images,
+            "processed_images": processed_images,
+            "failed_images": failed_images,
+            "transaction_dict": self.transaction_dict,
+        }
+        new_block = self.blockchain.add_transaction(batch_payload, info="embedder")
 
         # Verify chain
         is_valid = self.blockchain.verify_chain()
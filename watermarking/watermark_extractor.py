@@ -1,5 +1,6 @@
 import hashlib
-from copy import deepcopy
+import os
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union, Tuple, Optional, List
 from dataclasses import dataclass
 import numpy as np
@@ -8,10 +9,22 @@ from pydicom import dcmread
 from blockchain.blockchain import Blockchain
 from utils.utils import (
     generate_random_binary_array_from_string,
-    compute_ber,
-    reshape_and_compute
+    compute_ber
 )
-from watermarking.utils import compute_hash, hex_to_binary_array
+from watermarking.kernels import extract_loop
+from watermarking.utils import compute_hash, compute_neighbourhood_sums, hex_to_binary_array
+
+
+def _candidate_ber(image: np.ndarray, transaction: dict) -> float:
+    """Score one candidate transaction against the image in a worker process."""
+    _, extracted_bits_256 = WatermarkExtractor._extract_watermark_from_image(
+        image, transaction
+    )
+    original_watermark = hex_to_binary_array(transaction["watermark"])
+    extracted_watermark_256 = np.array(
+        [int(i / j > 0.5) for i, j in extracted_bits_256]
+    )
+    return compute_ber(extracted_watermark_256, original_watermark)
 
 
 @dataclass
@@ -24,34 +37,31 @@ class ExtractionResult:
 
 
 class WatermarkExtractor:
-    def __init__(self, config):
+    def __init__(self, config, blockchain: Blockchain = None):
         self.config = config
-        self.blockchain = Blockchain(config.blockchain_path)
+        self.blockchain = (blockchain if blockchain is not None
+                           else Blockchain(config.blockchain_path))
 
     def _load_image(self) -> np.ndarray:
         """Load image based on data type."""
         if self.config.data_type == "dcm":
-            return dcmread(self.config.data_path).pixel_array
-        return np.array(Image.open(self.config.data_path).convert('L'))
+            return np.ascontiguousarray(dcmread(self.config.data_path).pixel_array)
+        return np.asarray(Image.open(self.config.data_path).convert('L'))
 
+    @staticmethod
     def _extract_watermark_from_image(
-            self,
             image: np.ndarray,
             transaction: dict
     ):
         """Extract watermark from image using given parameters."""
         # Setup parameters
-        kernel = np.array(transaction["kernel"])
+        kernel = np.ascontiguousarray(transaction["kernel"], dtype=np.float64)
         stride = transaction["stride"]
         t_hi = transaction["t_hi"]
         max_pixel_value = 2 ** transaction["bit_depth"]
 
         # Initialize arrays
-        recovered_image = deepcopy(image)
-        extracted_bits = []
-        extracted_bits_256 = np.zeros((256, 2)).astype(np.float64)
-        pos_wat = 0
-        overflow_positions = []
+        recovered_image = image.copy()
 
         # Generate secret positions
         image_size = image.size
@@ -60,63 +70,31 @@ class WatermarkExtractor:
             image_size
         )
 
-        # Calculate dimensions
-        height, width = image.shape
+        # With non-overlapping regions no center write can change a later
+        # region, so all neighbour sums can be computed up front
         k_height, k_width = kernel.shape
-        out_height = (height - k_height) // stride + 1
-        out_width = (width - k_width) // stride + 1
-        idx_secret_key = 0
-        # Extraction loop
-        for y in range(out_height):
-            for x in range(out_width):
-                if secret_positions[idx_secret_key] == 0:
-                    idx_secret_key +=1
-                    continue
-
-                # Get region coordinates
-                y_start = y * stride
-                x_start = x * stride
-                y_center = y_start + k_height // 2
-                x_center = x_start + k_width // 2
-
-                # Extract region and calculate values
-                region = recovered_image[y_start:y_start + k_height,
-                         x_start:x_start + k_width]
-                neighbors = np.sum(region * kernel) // 1
-                center = recovered_image[y_center, x_center]
-
-                error_w = center - neighbors
-                if error_w < 0:
-                    idx_secret_key += 1
-                    continue
-
-                if center == max_pixel_value - 1:
-                    overflow_positions.append((y_center, x_center))
-                    idx_secret_key += 1
-                    continue
-
-                # Extract bit and update image
-                error, bit = self._extraction_value(error_w, t_hi)
-                if bit in (0, 1):
-                    extracted_bits.append(bit)
-                    extracted_bits_256[idx_secret_key%256][0] += bit
-                    extracted_bits_256[idx_secret_key%256][1] += 1
-                    if y< 1:
-                        print("ext pos", y, x, bit)
-                idx_secret_key += 1
-                recovered_image[y_center, x_center] = neighbors + error
-
-        if not overflow_positions:
-            return np.array(extracted_bits), np.array(extracted_bits_256)
+        precompute_safe = stride >= max(k_height, k_width)
+        if precompute_safe:
+            neighbour_sums = compute_neighbourhood_sums(recovered_image, kernel, stride)
         else:
-            return np.array(extracted_bits[:-len(overflow_positions) - 1]), np.array(extracted_bits_256)
+            neighbour_sums = np.zeros((1, 1), dtype=np.int64)
 
-    @staticmethod
-    def _extraction_value(error_w: int, thresh_hi: int) -> Tuple[int, Optional[int]]:
-        """Calculate extraction value and bit."""
-        if error_w > (2 * thresh_hi + 1):
-            return error_w - thresh_hi - 1, None
-        return (error_w - error_w % 2) // 2, error_w % 2
+        # Extraction loop
+        extracted_bits, bit_positions, overflow_count = extract_loop(
+            recovered_image, neighbour_sums, precompute_safe, kernel, stride,
+            float(t_hi), secret_positions, max_pixel_value
+        )
+
+        # fold the accepted bits into the per-watermark-position vote
+        # table in two C-level bincount passes
+        mod = bit_positions & 255
+        extracted_bits_256 = np.zeros((256, 2), dtype=np.float64)
+        extracted_bits_256[:, 0] = np.bincount(mod, weights=extracted_bits, minlength=256)
+        extracted_bits_256[:, 1] = np.bincount(mod, minlength=256)
+
+        if not overflow_count:
+            return extracted_bits, extracted_bits_256
+        return extracted_bits[:-overflow_count - 1], extracted_bits_256
 
     def extract(self) -> dict:
         """Main extraction method."""
@@ -128,30 +106,38 @@ class WatermarkExtractor:
         history, transaction = self.blockchain.get_transaction_history(image_hash)
         if not transaction:
             print("No matching image hash found in blockchain")
-            blocks = self.blockchain.blocks
-            for _, block in blocks.items():
-                if block.info == "embedder":
-                    for _, transaction_current in block.transaction["transaction_dict"].items():
-                        if transaction_current["data_type"] == self.config.data_type:
-                            extracted_watermark, extracted_watermark_256 = self._extract_watermark_from_image(image, transaction_current)
-
-                            original_watermark = hex_to_binary_array(transaction_current["watermark"])
-                            extracted_watermark = reshape_and_compute(extracted_watermark)
-                            # print("ext wat", [int(i/j>0.5) for i, j in extracted_watermark_256])
-                            # print("original wat", original_watermark)
-                            extracted_watermark_256 = np.array([int(i/j>0.5) for i, j in extracted_watermark_256])
-
-                            ber = compute_ber(extracted_watermark_256, original_watermark)
-                            if ber < 0.4:
-                                history = {
-                                    'ber': ber,
-                                    'block_number': block.header.block_number,
-                                    'block_hash': block.hash,
-                                    'timestamp': block.header.timestamp,
-                                    'info': block.info,
-                                    'image_hash': transaction_current['hash_image_wat']
-                                }
-                                return history
+            # candidate transactions are independent extractions against
+            # the same image, so score them in parallel workers and keep
+            # the scan-order first match
+            candidates = [
+                (block, transaction_current)
+                for _, block in self.blockchain.blocks.items()
+                if block.info == "embedder"
+                for _, transaction_current in block.transaction["transaction_dict"].items()
+                if transaction_current["data_type"] == self.config.data_type
+            ]
+
+            if candidates:
+                max_workers = min(os.cpu_count() or 1, len(candidates))
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [
+                        executor.submit(_candidate_ber, image, transaction_current)
+                        for _, transaction_current in candidates
+                    ]
+                    for future, (block, transaction_current) in zip(futures, candidates):
+                        ber = future.result()
+                        if ber < 0.4:
+                            for later in futures:
+                                later.cancel()
+                            history = {
+                                'ber': ber,
+                                'block_number': block.header.block_number,
+                                'block_hash': block.hash,
+                                'timestamp': block.header.timestamp,
+                                'info': block.info,
+                                'image_hash': transaction_current['hash_image_wat']
+                            }
+                            return history
 
             history = {
                 'ber': 0.5,
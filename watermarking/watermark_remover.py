@@ -1,5 +1,4 @@
 import hashlib
-from copy import deepcopy
 from typing import Union, Tuple, Dict, Optional
 from dataclasses import dataclass
 import numpy as np
@@ -9,7 +8,9 @@ from datetime import datetime
 
 from blockchain.blockchain import Blockchain
 from utils.utils import generate_random_binary_array_from_string, compute_ber
-from watermarking.utils import bits_to_hexdigest, hex_to_binary_array, compute_hash
+from watermarking.kernels import remove_loop
+from watermarking.utils import bits_to_hexdigest, hex_to_binary_array, compute_hash, \
+    compute_neighbourhood_sums
 
 
 @dataclass
@@ -36,31 +37,61 @@ class RemovalTransaction:
     removal_parameters: Dict = None
 
 
+def write_payload(payload: Tuple[str, str, object]) -> None:
+    """Write one deferred (kind, path, obj) save produced by WatermarkRemove."""
+    kind, path, obj = payload
+    if kind == "npy":
+        np.save(path, obj)
+    elif kind == "dcm":
+        obj.save_as(path)
+    else:
+        obj.save(path)
+
+
 class WatermarkRemove:
-    def __init__(self, config):
+    def __init__(self, config, blockchain: Blockchain = None, write_sink=None):
         self.config = config
-        self.blockchain = Blockchain(config.blockchain_path)
+        self.blockchain = (blockchain if blockchain is not None
+                           else Blockchain(config.blockchain_path))
+        # optional callable taking write_payload tuples; when set, saves
+        # are handed off (e.g. to a batch writer thread) instead of done
+        # inline, so extraction never stalls on disk latency
+        self.write_sink = write_sink
+
+    def configure(self, config, blockchain: Blockchain = None, write_sink=None):
+        """Point this extractor at a new image without reopening the chain.
+
+        Lets batch workers reuse one instance per worker: the blockchain
+        is only reloaded from disk when its path actually changes (or a
+        live instance is handed in), instead of once per image.
+        """
+        if blockchain is not None:
+            self.blockchain = blockchain
+        elif config.blockchain_path != self.config.blockchain_path:
+            self.blockchain = Blockchain(config.blockchain_path)
+        self.config = config
+        self.write_sink = write_sink
+        return self
 
     def _load_image(self) -> Tuple[np.ndarray, Optional[dcmread]]:
         """Load image and return array and DICOM dataset if applicable."""
         if self.config.data_type == "dcm":
             ds = dcmread(self.config.data_path)
-            return np.array(ds.pixel_array), ds
+            return np.ascontiguousarray(ds.pixel_array), ds
         image = Image.open(self.config.data_path).convert('L')
-        return np.array(image), None
+        return np.asarray(image), None
 
-    def _extract_watermark(self, image: np.ndarray, transaction: Dict) -> Tuple[np.ndarray, np.ndarray, list]:
+    def _extract_watermark(self, image: np.ndarray, transaction: Dict) \
+            -> Tuple[np.ndarray, np.ndarray, Tuple[np.ndarray, np.ndarray]]:
         """Extract watermark from image using transaction parameters."""
         # Setup parameters
-        kernel = np.array(transaction["kernel"])
+        kernel = np.ascontiguousarray(transaction["kernel"], dtype=np.float64)
         stride = transaction["stride"]
         t_hi = transaction["t_hi"]
         max_pixel_value = 2 ** transaction["bit_depth"]
 
         # Initialize arrays
-        recovered_image = deepcopy(image)
-        extracted_bits = []
-        overflow_positions = []
+        recovered_image = image.copy()
 
         # Generate secret positions
         image_size = image.size
@@ -69,83 +100,66 @@ class WatermarkRemove:
             image_size
         )
 
-        # Calculate dimensions
-        height, width = image.shape
+        # With non-overlapping regions no center write can change a later
+        # region, so all neighbour sums can be computed up front; when
+        # regions overlap the kernel evaluates them against the live image
         k_height, k_width = kernel.shape
-        out_height = (height - k_height) // stride + 1
-        out_width = (width - k_width) // stride + 1
+        precompute_safe = stride >= max(k_height, k_width)
+        if precompute_safe:
+            neighbour_sums = compute_neighbourhood_sums(recovered_image, kernel, stride)
+        else:
+            neighbour_sums = np.zeros((1, 1), dtype=np.int64)
 
         # Extraction loop
-        for y in range(out_height):
-            for x in range(out_width):
-                if not secret_positions[y * out_width + x]:
-                    continue
-
-                # Get region coordinates
-                y_start = y * stride
-                x_start = x * stride
-                y_center = y_start + k_height // 2
-                x_center = x_start + k_width // 2
-
-                # Extract region and calculate values
-                region = recovered_image[y_start:y_start + k_height,
-                         x_start:x_start + k_width]
-                neighbors = np.sum(region * kernel) // 1
-                center = recovered_image[y_center, x_center]
-
-                error_w = center - neighbors
-                if error_w < 0:
-                    continue
-
-                if center == max_pixel_value - 1:
-                    overflow_positions.append((y_center, x_center))
-                    continue
-
-                # Extract bit and update image
-                error, bit = self._extraction_value(error_w, t_hi)
-                if bit in (0, 1):
-                    extracted_bits.append(bit)
-
-                recovered_image[y_center, x_center] = neighbors + error
-
-        return recovered_image, np.array(extracted_bits), overflow_positions
-
-    @staticmethod
-    def _extraction_value(error_w: int, thresh_hi: int) -> Tuple[int, Optional[int]]:
-        """Calculate extraction value and bit."""
-        if error_w > (2 * thresh_hi + 1):
-            return error_w - thresh_hi - 1, None
-        bit = error_w % 2
-        return (error_w - bit) // 2, bit
+        extracted_bits, overflow_ys, overflow_xs = remove_loop(
+            recovered_image, neighbour_sums, precompute_safe, kernel, stride,
+            float(t_hi), secret_positions, max_pixel_value
+        )
+        return recovered_image, extracted_bits, (overflow_ys, overflow_xs)
 
     @staticmethod
     def _handle_overflow(recovered_image: np.ndarray,
                          extracted_bits: np.ndarray,
-                         overflow_positions: list) -> Tuple[np.ndarray, np.ndarray]:
+                         overflow_positions: Tuple[np.ndarray, np.ndarray]
+                         ) -> Tuple[np.ndarray, np.ndarray]:
         """Handle overflow positions in extraction."""
-        if not overflow_positions:
+        overflow_ys, overflow_xs = overflow_positions
+        count = len(overflow_ys)
+        if not count:
             return recovered_image, extracted_bits
 
-        overflow_wat = extracted_bits[-len(overflow_positions):]
-        for idx, pos in enumerate(overflow_positions):
-            recovered_image[pos] -= overflow_wat[idx]
+        if count > len(extracted_bits):
+            # a short tail slice would silently broadcast across all
+            # overflow positions and write a corrupted "recovered" image;
+            # the recorded bits cannot cover the overflows, so this image
+            # does not match the embedding and must fail
+            raise ValueError(
+                f"{count} overflow positions but only {len(extracted_bits)} "
+                "extracted bits; image does not match the recorded embedding")
 
-        return recovered_image, extracted_bits[:-len(overflow_positions) - 1]
+        # one fancy-indexed scatter instead of a Python loop per position
+        recovered_image[overflow_ys, overflow_xs] -= extracted_bits[-count:]
+
+        return recovered_image, extracted_bits[:-count - 1]
 
     def _save_results(self,
                       recovered_image: np.ndarray,
                       extracted_watermark: str,
                       dicom_ds: Optional[dcmread]) -> None:
         """Save recovered image and extracted watermark."""
-        # Save extracted watermark
-        np.save(self.config.ext_wat_path, extracted_watermark)
-
-        # Save recovered image
+        payloads = [("npy", self.config.ext_wat_path, extracted_watermark)]
         if dicom_ds is not None:
             dicom_ds.PixelData = recovered_image.tobytes()
-            dicom_ds.save_as(self.config.save_path)
+            payloads.append(("dcm", self.config.save_path, dicom_ds))
         else:
-            Image.fromarray(np.uint8(recovered_image)).save(self.config.save_path)
+            payloads.append(("img", self.config.save_path,
+                             Image.fromarray(np.uint8(recovered_image))))
+
+        for payload in payloads:
+            if self.write_sink is not None:
+                self.write_sink(payload)
+            else:
+                write_payload(payload)
 
     def extract_and_remove(self) -> RemoveResult:
         """Main method to extract watermark and recover original image."""
@@ -1,108 +1,372 @@
+import copy
 import os
+from collections import deque
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import List, Optional
 import json
 from datetime import datetime
-from dataclasses import asdict, dataclass
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import threading
+import time
 from tqdm import tqdm
 
 from PIL import Image
 
-from watermarking.utils import get_image_files
-from watermarking.watermark_remover import WatermarkRemove
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from watermarking.utils import SUPPORTED_FORMATS, _sha256_backend, iter_image_files
+from watermarking.watermark_remover import WatermarkRemove, write_payload
 from blockchain.blockchain import Blockchain
 
 
-@dataclass
+# workers enqueue log records without taking the stream lock and a
+# listener thread drains them, so a batch where every image errors never
+# serializes the pool behind stderr flushes or tears the tqdm bar
+logger = logging.getLogger(__name__)
+_log_queue = queue.Queue(-1)
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+
+
+class _PidAwareQueueHandler(QueueHandler):
+    """Queue records only in the process that owns the listener.
+
+    Forked process-pool workers inherit this handler and the queue but
+    not the listener thread, so anything they enqueue is silently
+    dropped; outside the owning process records go straight to the
+    stream handler instead (each worker has its own copy and lock, so
+    nothing is serialized across the pool).
+    """
+
+    _owner_pid = os.getpid()
+
+    def emit(self, record):
+        if os.getpid() == self._owner_pid:
+            super().emit(record)
+        else:
+            _log_handler.handle(record)
+
+
+logger.addHandler(_PidAwareQueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+
+# consecutive failures before a batch with no successes yet is aborted,
+# so a systemic misconfiguration surfaces in seconds instead of after
+# grinding through the whole dataset
+_FAILURE_STREAK_LIMIT = 16
+
+
+# one extractor per worker thread (and per process-pool worker, which is
+# single-threaded), so the blockchain DB is loaded once per worker
+# instead of once per image
+_worker_state = threading.local()
+
+
+def _remove_single(cfg, img_path: Path, blockchain: Blockchain = None,
+                   write_sink=None) -> tuple:
+    """Recover one image and return (img_path, success, transaction, ber).
+
+    Module-level so it is picklable for the process pool; without a
+    shared blockchain each worker opens its own from cfg.blockchain_path.
+    """
+    try:
+        extractor = getattr(_worker_state, "extractor", None)
+        if extractor is None:
+            extractor = WatermarkRemove(cfg, blockchain=blockchain,
+                                        write_sink=write_sink)
+            _worker_state.extractor = extractor
+        else:
+            extractor.configure(cfg, blockchain=blockchain,
+                                write_sink=write_sink)
+        result = extractor.extract_and_remove()
+        return img_path, True, result.transaction, result.ber
+    except (ValueError, OSError):
+        # domain failures (no matching watermark, unreadable file) count
+        # against the batch; anything else propagates to fail it outright
+        logger.error("Error processing %s", img_path.name, exc_info=True)
+        return img_path, False, None, None
+
+
+def _dumps_transaction_line(transaction: dict) -> bytes:
+    """Serialize one removal transaction to a JSONL line."""
+    if orjson is not None:
+        return orjson.dumps(transaction) + b"\n"
+    return (json.dumps(transaction) + "\n").encode()
+
+
+def _touch_file(path: Path) -> None:
+    """Stream a file once to warm the page cache for the upcoming read.
+
+    Run on a few background threads so the workers' Image.open/dcmread
+    hit cached pages instead of issuing cold blocking reads; keeping
+    several reads in flight is what lets the device serve them at queue
+    depth. Fire-and-forget: decoding never waits on it.
+    """
+    try:
+        with open(path, "rb") as file:
+            while file.read(1 << 20):
+                pass
+    except OSError:
+        pass
+
+
+def _drain_writes(writer_queue: "queue.Queue", failed_paths: list) -> None:
+    """Writer-thread loop: pop deferred saves until the None sentinel.
+
+    Destination paths of saves that raise are recorded in failed_paths
+    so the batch can fold them into its failure accounting after the
+    join; appends are atomic and the owner only reads after join().
+    """
+    while True:
+        payload = writer_queue.get()
+        if payload is None:
+            break
+        try:
+            write_payload(payload)
+        except Exception:
+            logger.error("Error writing %s", payload[1], exc_info=True)
+            failed_paths.append(payload[1])
+        finally:
+            writer_queue.task_done()
+
+
+@dataclass(slots=True)
 class BatchRemoveTransaction:
     """Data class for batch transaction"""
     processing_time: float
     total_images: int = 0
     processed_images: int = 0
-    failed_images: List[str] = None
-    transaction_dict: Dict[str, dict] = None
+    failed_images: List[str] = field(default_factory=list)
+    transactions_file: str = ""
+    transactions_merkle_root: str = ""
     average_ber: float = 0.5
 
 
 class BatchRemoveProcessor:
-    def __init__(self, config):
+    def __init__(self, config, blockchain: Blockchain = None):
         self.config = config
-        self.supported_formats: Set[str] = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.dcm'}
-        self.blockchain = Blockchain(config.blockchain_path)
+        self.blockchain = (blockchain if blockchain is not None
+                           else Blockchain(config.blockchain_path))
 
-    def process_single_image(self, img_path: Path, rec_path: Path, wat_path: Path) -> tuple:
-        """Process a single image and return results."""
-        try:
-            # Update config for current image
-            self.config.data_path = str(img_path)
-            save_name = f"recovered_{img_path.name}"
-            self.config.save_path = str(rec_path) + "/" + save_name
-            self.config.ext_wat_path = str(wat_path) + '.npy'
-
-            # Create extractor and process image
-            extractor = WatermarkRemove(self.config)
-            result = extractor.extract_and_remove()
-
-            return (
-                img_path,
-                True,
-                result.transaction,
-                result.ber
-            )
+    def _build_config(self, img_path: Path, rec_prefix: str, wat_prefix: str):
+        """Build an independent per-image config copy."""
+        # Each call gets its own shallow config copy, so workers never
+        # race on the shared paths and can run truly concurrently; the
+        # directory prefixes are stringified once by the caller instead
+        # of per image. Each image gets its own .npy under ext_wat_path
+        # (writing to one shared path clobbered earlier watermarks).
+        cfg = copy.copy(self.config)
+        cfg.data_path = str(img_path)
+        cfg.save_path = os.path.join(rec_prefix, f"recovered_{img_path.name}")
+        cfg.ext_wat_path = os.path.join(wat_prefix, f"{img_path.stem}.npy")
+        return cfg
 
-        except Exception as e:
-            print(f"Error processing {img_path.name}: {str(e)}")
-            return img_path, False, None, None
+    def process_single_image(self, img_path: Path, rec_prefix: str, wat_prefix: str,
+                             write_sink=None) -> tuple:
+        """Process a single image and return results."""
+        cfg = self._build_config(img_path, rec_prefix, wat_prefix)
+        return _remove_single(cfg, img_path, blockchain=self.blockchain,
+                              write_sink=write_sink)
 
     def process_images(self) -> BatchRemoveTransaction:
         """Process all images in the configured directory."""
-        start_time = datetime.now()
+        # monotonic clock: immune to NTP slews and cheaper than datetime
+        start_time = time.perf_counter()
 
-        # Get all image files
         try:
-            image_files = get_image_files(self.supported_formats, self.config.data_path)
-            total_images = len(image_files)
-
-            if not total_images:
-                raise ValueError(f"No supported images found in {self.config.data_path}")
-
-            # Create save directory
+            # Create output directories once per batch; ext_wat_path is a
+            # directory holding one <stem>.npy per image, not a file
             save_path = Path(self.config.save_path)
             ext_wat_path = Path(self.config.ext_wat_path)
             save_path.mkdir(parents=True, exist_ok=True)
-            ext_wat_path.mkdir(parents=True, exist_ok=True)
+            if ext_wat_path != save_path:
+                ext_wat_path.mkdir(parents=True, exist_ok=True)
+
+            # stringify the output directories once rather than per image
+            rec_prefix = str(save_path)
+            wat_prefix = str(ext_wat_path)
+
+            # names already recovered by an earlier (partial) run; one
+            # scandir sweep instead of an exists() stat per image
+            done = {entry.name for entry in os.scandir(rec_prefix)}
+            skipped_images = 0
 
             # Process images using thread pool
-            successful_extractions = {}
             failed_images = []
-            image_transactions = {}
+            # running BER aggregate; avoids keeping per-image BERs around
+            # just to average them in a second pass at the end
+            ber_sum = 0.0
+            ber_count = 0
+            total_images = 0
 
-            with ThreadPoolExecutor() as executor:
-                # futures = [executor.submit(self.process_single_image, img_path)
-                #            for img_path in image_files]
+            # stream per-image transactions to a sidecar file instead of
+            # holding every dict live until the block write; the block
+            # records the file plus a rolling digest over this batch's
+            # appended lines, so it stays O(1) regardless of batch size
+            transactions_path = save_path / "_transactions.jsonl"
+            transactions_log = open(transactions_path, "ab")
+            transactions_hash = _sha256_backend()
 
-                futures = [self.process_single_image(img_path, save_path, ext_wat_path)
-                           for img_path in image_files]
+            # the batch runs inside a long-lived API process, so the pools,
+            # the progress bar, the writer thread and the sidecar fd must be
+            # released on the abort path too, not just on success; None
+            # guards cover exceptions raised before a resource exists
+            writer_queue = writer = None
+            prefetch_pool = None
+            progress = None
+            try:
+                max_workers = getattr(self.config, "max_concurrency", None) or os.cpu_count() or 1
+                # the extraction loops are CPU-bound and hold the GIL, so a
+                # process pool is the default scaling path; threads remain
+                # available for I/O-dominated batches via executor_kind
+                use_processes = getattr(self.config, "executor_kind", "process") == "process"
+                executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
 
-                # Process results with progress bar
-                for future in tqdm(futures, total=len(futures), desc="Processing images"):
-                    img_path, success, transaction, ber = future  # .result()
+                # In thread mode a single writer thread drains deferred saves,
+                # so the recovered-image/.npy writes of one image overlap with
+                # the extraction of the next; process workers write inline
+                # since they already overlap each other. Results whose saves
+                # are still queued are held in deferred_results until the
+                # drain confirms them, so an image whose files never hit the
+                # disk is not attested in the sidecar or counted processed
+                write_failures = []
+                deferred_results = []
+                if not use_processes:
+                    writer_queue = queue.Queue(maxsize=2 * max_workers)
+                    writer = threading.Thread(target=_drain_writes,
+                                              args=(writer_queue, write_failures),
+                                              daemon=True)
+                    writer.start()
 
-                    if success:
-                        image_hash = transaction["watermarked_image_hash"]
-                        successful_extractions[image_hash] = ber
-                        image_transactions[image_hash] = transaction
-                    else:
+                # a few read-ahead threads warm the page cache a submission
+                # window ahead of the workers
+                prefetch_pool = ThreadPoolExecutor(max_workers=4,
+                                                   thread_name_prefix="prefetch")
+
+                # bound the in-flight futures so enumerating a huge directory
+                # cannot queue the whole tree in memory before work starts
+                max_in_flight = 2 * max_workers
+                inflight = deque()
+                progress = tqdm(desc="Processing images", unit="img")
+
+                failure_streak = 0
+
+                def collect(future):
+                    """Fold one finished worker result into the running stats."""
+                    nonlocal ber_sum, ber_count, failure_streak
+                    img_path, success, transaction, ber = future.result()
+                    if not success:
                         failed_images.append(str(img_path))
+                        failure_streak += 1
+                    elif writer is not None:
+                        # the files may still be queued behind the writer;
+                        # finalize only after the drain proves they exist
+                        deferred_results.append((img_path, transaction, ber))
+                        failure_streak = 0
+                    else:
+                        line = _dumps_transaction_line(transaction)
+                        transactions_log.write(line)
+                        transactions_hash.update(line)
+                        ber_sum += ber
+                        ber_count += 1
+                        failure_streak = 0
+                    progress.update(1)
+                    if (failure_streak >= _FAILURE_STREAK_LIMIT
+                            and not ber_count and not deferred_results):
+                        # nothing has succeeded and everything is failing the
+                        # same way: almost certainly a misconfiguration, so
+                        # stop feeding the pool instead of burning the batch
+                        for pending in inflight:
+                            pending.cancel()
+                        raise RuntimeError(
+                            f"first {failure_streak} images all failed; "
+                            "aborting batch (see logged errors)")
+
+                with executor_cls(max_workers=max_workers) as executor:
+                    # stream paths straight off scandir so the first workers
+                    # start while the directory is still being enumerated
+                    for img_path in iter_image_files(SUPPORTED_FORMATS,
+                                                     self.config.data_path):
+                        total_images += 1
+                        if f"recovered_{img_path.name}" in done:
+                            skipped_images += 1
+                            continue
+                        prefetch_pool.submit(_touch_file, img_path)
+                        if len(inflight) >= max_in_flight:
+                            finished = next(as_completed(inflight))
+                            inflight.remove(finished)
+                            collect(finished)
+                        if use_processes:
+                            inflight.append(executor.submit(
+                                _remove_single,
+                                self._build_config(img_path, rec_prefix, wat_prefix),
+                                img_path))
+                        else:
+                            inflight.append(executor.submit(
+                                self.process_single_image, img_path,
+                                rec_prefix, wat_prefix, writer_queue.put))
+
+                    # consume the tail as workers finish rather than in
+                    # submission order, so one slow image never stalls
+                    # collection or the progress bar
+                    for future in as_completed(inflight):
+                        collect(future)
+
+                if writer is not None:
+                    # drain the queue and stop the writer before timing ends,
+                    # so the recovered files are on disk when we report
+                    writer_queue.put(None)
+                    writer.join()
+
+                    # only now is it known which deferred saves succeeded;
+                    # an image with a failed recovered-image or watermark
+                    # write counts failed, everything else is attested in
+                    # the sidecar exactly as in the inline-write path
+                    failed_paths = set(write_failures)
+                    for img_path, transaction, ber in deferred_results:
+                        rec_file = os.path.join(rec_prefix,
+                                                f"recovered_{img_path.name}")
+                        npy_file = os.path.join(wat_prefix,
+                                                f"{img_path.stem}.npy")
+                        if rec_file in failed_paths or npy_file in failed_paths:
+                            failed_images.append(str(img_path))
+                            continue
+                        line = _dumps_transaction_line(transaction)
+                        transactions_log.write(line)
+                        transactions_hash.update(line)
+                        ber_sum += ber
+                        ber_count += 1
+            finally:
+                if progress is not None:
+                    progress.close()
+                if prefetch_pool is not None:
+                    prefetch_pool.shutdown(wait=False)
+                if writer is not None and writer.is_alive():
+                    # aborted before the normal drain above: stop the
+                    # writer rather than leak its thread
+                    writer_queue.put(None)
+                    writer.join()
+                transactions_log.close()
+
+            if not total_images:
+                raise ValueError(f"No supported images found in {self.config.data_path}")
 
             # Calculate statistics
-            processed_images = len(successful_extractions)
-            average_ber = (sum(successful_extractions.values()) / processed_images
-                           if processed_images > 0 else 0.0)
+            processed_images = ber_count
+            average_ber = ber_sum / ber_count if ber_count else 0.0
 
-            processing_time = (datetime.now() - start_time).total_seconds()
+            processing_time = time.perf_counter() - start_time
 
             # Create batch transaction
             batch_transaction = BatchRemoveTransaction(
@@ -111,30 +375,48 @@ class BatchRemoveProcessor:
                 failed_images=failed_images,
                 processing_time=processing_time,
                 average_ber=average_ber,
-                transaction_dict=image_transactions,
+                transactions_file=str(transactions_path),
+                transactions_merkle_root=transactions_hash.hexdigest(),
             )
 
             # # Add to blockchain
-            new_block = self.blockchain.add_transaction(asdict(batch_transaction), info="remover")
+            # flat dict built by hand; asdict would deep-copy the fields
+            # for no benefit. The block stays O(1): per-image transactions
+            # live in the sidecar, pinned by the rolling digest
+            batch_payload = {
+                "processing_time": processing_time,
+                "total_images": total_images,
+                "processed_images": processed_images,
+                "failed_images": failed_images,
+                "transactions_file": batch_transaction.transactions_file,
+                "transactions_merkle_root": batch_transaction.transactions_merkle_root,
+                "average_ber": average_ber,
+            }
+            new_block = self.blockchain.add_transaction(batch_payload, info="remover")
 
             # Verify chain
             is_valid = self.blockchain.verify_chain()
-            print(f"\nBlockchain is valid: {is_valid}")
+            logger.info("Blockchain is valid: %s", is_valid)
+
+            logger.info("New block created:")
+            logger.info("Block number: %s", new_block.header.block_number)
+            logger.info("Block hash: %s", new_block.hash)
+            logger.info("Timestamp: %s",
+                        datetime.fromtimestamp(new_block.header.timestamp))
 
-            print(f"\nNew block created:")
-            print(f"Block number: {new_block.header.block_number}")
-            print(f"Block hash: {new_block.hash}")
-            print(f"Timestamp: {datetime.fromtimestamp(new_block.header.timestamp)}")
+            logger.info("Batch removal completed in %.2f seconds", processing_time)
+            logger.info("Successfully processed: %d/%d images",
+                        processed_images, total_images)
 
-            print(f"\nBatch embedding completed in {processing_time:.2f} seconds")
-            print(f"Successfully processed: {processed_images}/{total_images} images")
+            if skipped_images:
+                logger.info("Skipped %d already-recovered images", skipped_images)
 
             if failed_images:
-                print(f"Failed to process {len(failed_images)} images")
+                logger.info("Failed to process %d images", len(failed_images))
 
             return batch_transaction
 
-        except Exception as e:
-            print(f"Batch processing failed: {str(e)}")
+        except Exception:
+            logger.error("Batch processing failed", exc_info=True)
             raise
 